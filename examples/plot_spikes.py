@@ -15,9 +15,11 @@ import matplotlib.pyplot as plt
 sfreq = 100
 n_trials = 10
 time_mean = .5
-spikes_per_trial = [np.random.randint(25, 50) for _ in range(n_trials)]
-spiketimes = np.array([.1 * np.random.randn(ii) + time_mean
-                       for ii in spikes_per_trial])
+spikes_per_trial = np.random.randint(25, 50, size=n_trials)
+offsets = np.cumsum(spikes_per_trial)
+# Draw all spikes at once, then split them up into trials
+spikes_all = .1 * np.random.randn(offsets[-1]) + time_mean
+spiketimes = np.split(spikes_all, offsets[:-1])
 # Each item is a list of spike times
 print(spiketimes[:2])
 
@@ -1,7 +1,39 @@
 """Defines small data structures for representing spike trains."""
 
+from functools import lru_cache
+from importlib.util import find_spec
+
 import numpy as np
 
+# numba is optional, only import it (and compile) once spikes are binned
+_has_numba = find_spec('numba') is not None
+
+
+@lru_cache(maxsize=None)
+def _get_bin_spikes_numba():
+    """Compile the numba kernel that counts spikes into (trial, sample) bins.
+
+    The compiled kernel is cached on disk, so this is only slow the first
+    time it is ever used.
+    """
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True)
+    def _bin_spikes_numba(flat_bins, trial_offsets, out):
+        for ii in prange(out.shape[0]):
+            for jj in range(trial_offsets[ii], trial_offsets[ii + 1]):
+                out[ii, flat_bins[jj]] += 1
+        return out
+    return _bin_spikes_numba
+
+
+def _as_counts(data):
+    """Store spike counts as uint16 unless a bin holds more than it can."""
+    if data.max() > np.iinfo(np.uint16).max:
+        return data
+    return data.astype(np.uint16)
+
+
 class Neuron(object):
     """Represent spike times during events in a single neuron.
 
@@ -28,65 +60,176 @@ class Neuron(object):
 
     Attributes
     ----------
-    spikes : array, shape (n_events, n_times), dtype int
-        A boolean array corresponding to the spikes for each timepoint.
+    spikes : array, shape (n_events, n_times), dtype uint16
+        An array with the number of spikes at each timepoint.
         If multiple spikes fall within a single time bin (e.g., because
-        sfreq is relatively low), then they will be summed together.
+        sfreq is relatively low), then they will be summed together. This
+        is computed once on first access and then cached. uint16 holds up to
+        65535 spikes per bin; if any bin has more, a wider integer dtype is
+        used instead.
+    time : array, shape (n_times,)
+        The time of each sample in ``spikes``, created on access.
+    n_times : int
+        The number of samples in ``spikes``.
+    spiketimes : list of arrays, shape (n_events, n_spikes_per_event)
+        The spike times of each event, as views into ``flat_times``.
+    flat_times : array, shape (n_spikes,)
+        The spike times of all events concatenated into one array.
+    trial_offsets : array, shape (n_events + 1,)
+        The index in ``flat_times`` where the spikes of each event start.
+        The last item is the total number of spikes.
     """
     def __init__(self, spiketimes, sfreq=1e3, tmin=None, tmax=None, name=None,
                  events=None):
 
         if not isinstance(spiketimes[0], (list, np.ndarray)):
             spiketimes = [spiketimes]
-        self.spiketimes = spiketimes
-        self.max_spiketime = np.max([max(ii) for ii in spiketimes])
-        self.min_spiketime = np.min([min(ii) for ii in spiketimes])
-        self.n_epochs = len(self.spiketimes)
+        # Store all spikes in one contiguous array plus per-event offsets
+        n_spikes = [len(trial) for trial in spiketimes]
+        # Events without spikes add nothing, so leave them out of the concat
+        spiketimes_nonempty = [trial for trial, n in zip(spiketimes, n_spikes)
+                               if n > 0]
+        if len(spiketimes_nonempty) == 0:
+            raise ValueError('spiketimes must contain at least one spike')
+        flat_times = np.concatenate(spiketimes_nonempty)
+        self.flat_times = flat_times.astype(float, copy=False)
+        self.trial_offsets = np.concatenate([[0], np.cumsum(n_spikes)])
+        self.trial_offsets = self.trial_offsets.astype(np.intp)
+        self.max_spiketime = self.flat_times.max()
+        self.min_spiketime = self.flat_times.min()
+        self.n_epochs = len(spiketimes)
         self.sfreq = sfreq
 
         # Handle time
         tmin = np.min([0, self.min_spiketime]) if tmin is None else tmin
         tmax = self.max_spiketime if tmax is None else tmax
 
-        if tmax < tmin:
-            raise ValueError('tmax must be greater than or equal to tmin')
-        if tmax < self.max_spiketime:
-            raise ValueError('tmax must be greater than the max spike time')
-        if tmin > self.min_spiketime:
+        # This also implies tmin <= tmax, only work out what failed on error
+        if not tmin <= self.min_spiketime <= self.max_spiketime <= tmax:
+            if tmax < tmin:
+                raise ValueError('tmax must be greater than or equal to tmin')
+            if tmax < self.max_spiketime:
+                raise ValueError('tmax must be greater than the max spike '
+                                 'time')
             raise ValueError('tmin must be less than the minimum spike time')
-        time = np.arange(int(tmin * sfreq), int(tmax * sfreq))
-        self.time = time / float(sfreq)
+        self.n_times = int(tmax * sfreq) - int(tmin * sfreq)
         self.tmin = tmin
         self.tmax = tmax
 
+        # Correct for the epoch start, then convert to sample indices. The
+        # samples are evenly spaced so this doesn't need a search over time.
+        bins = np.floor((self.flat_times - tmin) * sfreq).astype(np.intp) - 1
+        # Spikes within the first sample period after tmin get bin -1, which
+        # wraps around to the last bin (as negative indexing used to)
+        bins[bins < 0] += self.n_times
+        # Rounding tmin and tmax to samples can leave a spike past the last one
+        if bins.min() < 0 or bins.max() >= self.n_times:
+            raise ValueError('Spikes fall outside the %s samples between tmin '
+                             'and tmax at sfreq=%s, increase tmax'
+                             % (self.n_times, sfreq))
+        self._flat_bins = bins
+
         self.name = name
         if events is not None:
             events = np.atleast_1d(events)
             if events.ndim != 1:
                 raise ValueError('Events must have a single dimension')
-            unique_events = np.unique(events)
+            # Dedupe with a hash set so only the unique events get sorted
+            unique_events = sorted(set(events.tolist()))
             event_id = {ev_id: ii for ii, ev_id in enumerate(unique_events)}
         else:
             events = np.ones(len(spiketimes))
             event_id = {'1': 1}
         self.events = events
         self.event_id = event_id
+        self._spikes = None
+        self._info = None
+
+    @classmethod
+    def from_many(cls, spiketimes, sfreq=1e3, tmin=None, tmax=None,
+                  names=None, events=None):
+        """Create several neurons that share the same events and times.
+
+        Parameters
+        ----------
+        spiketimes : list, shape (n_neurons,)
+            The spike times of each neuron, in the same format as for a
+            single ``Neuron``.
+        sfreq : float
+            The sampling frequency of the spikes.
+        tmin : float
+            The minimum time when spikes are converted to a timeseries.
+        tmax : float
+            The maximum time when spikes are converted to a timeseries.
+        names : list of string, shape (n_neurons,)
+            The name of each neuron.
+        events : array, shape (n_events,)
+            The type of each event, shared by all neurons.
+
+        Returns
+        -------
+        neurons : list of Neuron
+            The neurons. As for a single ``Neuron``, the spikes of each are
+            only binned when its ``spikes`` are first accessed.
+        """
+        if names is None:
+            names = [None] * len(spiketimes)
+        if len(names) != len(spiketimes):
+            raise ValueError('names must have one item per neuron')
+        return [cls(ispiketimes, sfreq=sfreq, tmin=tmin, tmax=tmax, name=name,
+                    events=events)
+                for ispiketimes, name in zip(spiketimes, names)]
 
     def __repr__(self):
         s = 'Name: {} | Num Events: {} | Events: {} | tmin/tmax: ({}, {})'.format(
         self.name, len(self.events), list(self.event_id.keys()), self.tmin, self.tmax)
         return s
 
+    @property
+    def time(self):
+        start = int(self.tmin * self.sfreq)
+        return np.arange(start, start + self.n_times) / float(self.sfreq)
+
+    @property
+    def spiketimes(self):
+        offsets = self.trial_offsets
+        return [self.flat_times[start:stop]
+                for start, stop in zip(offsets[:-1], offsets[1:])]
+
     @property
     def spikes(self):
-        data = np.zeros([self.n_epochs, len(self.time)])
-        for ii, trial in enumerate(self.spiketimes):
-            # Correct for the epoch start
-            trial_shifted = np.array(trial) - self.tmin
-            for spike in trial_shifted:
-                data[ii, int(spike * self.sfreq) - 1] += 1
+        if self._spikes is None:
+            self._spikes = self._bin_spikes()
+        return self._spikes
+
+    def _bin_spikes(self):
+        """Bin the spike times of each trial into an array of counts."""
+        n_times = self.n_times
+        # Neither path checks bounds, __init__ makes sure all bins are valid
+        if _has_numba:
+            # A bin can't hold more spikes than the trial it belongs to
+            n_spikes_max = np.diff(self.trial_offsets).max()
+            if n_spikes_max > np.iinfo(np.uint16).max:
+                dtype = np.intp
+            else:
+                dtype = np.uint16
+            data = np.zeros([self.n_epochs, n_times], dtype=dtype)
+            bin_spikes_numba = _get_bin_spikes_numba()
+            return bin_spikes_numba(self._flat_bins, self.trial_offsets, data)
+
+        # bincount sums spikes that share a bin (fancy-index assignment would
+        # drop them) and is much faster than an unbuffered np.add.at
+        data = np.bincount(self._flat_index(),
+                           minlength=self.n_epochs * n_times)
+        data = _as_counts(data.reshape([self.n_epochs, n_times]))
         return data
 
+    def _flat_index(self):
+        """Return the index of each spike in the flattened spikes array."""
+        n_spikes = np.diff(self.trial_offsets)
+        trial_idx = np.repeat(np.arange(self.n_epochs), n_spikes)
+        return trial_idx * self.n_times + self._flat_bins
+
     def to_mne(self):
         """Convert the spikes into an MNE Epochs object.
 
@@ -97,14 +240,28 @@ class Neuron(object):
             import mne
         except ModuleNotFoundError:
             raise ModuleNotFoundError('MNE is not installed.')
-        info = mne.create_info([str(self.name)], sfreq=self.sfreq, ch_types='misc')
-        data = self.spikes[:, np.newaxis, :]  # Add a singleton channel dimension
+        # The info only depends on the name and sfreq, so reuse it unless
+        # either has changed (MNE copies it)
+        ch_names = [str(self.name)]
+        if (self._info is None or self._info['ch_names'] != ch_names or
+                self._info['sfreq'] != self.sfreq):
+            self._info = mne.create_info(ch_names, sfreq=self.sfreq,
+                                         ch_types='misc')
+        info = self._info
+        # Fill a float array with a singleton channel dimension. This is the
+        # only copy of the spikes, as MNE uses C-contiguous float data as-is.
+        data = np.empty([self.n_epochs, 1, self.n_times])
+        data[:, 0] = self.spikes
         # If events are given in strings, convert to integers first
         events = self.events
         if isinstance(events[0], str):
-            events = [self.event_id[event] for event in events]
-        events = np.column_stack([range(len(events)), np.zeros_like(events), events])
-        events = events.astype(int)
-        epochs = mne.EpochsArray(data, info, events=events,
+            keys = np.array(list(self.event_id.keys()))
+            values = np.array(list(self.event_id.values()))
+            order = np.argsort(keys)
+            events = values[order][np.searchsorted(keys[order], events)]
+        mne_events = np.zeros([len(events), 3], dtype=np.int64)
+        mne_events[:, 0] = np.arange(len(events))
+        mne_events[:, 2] = events
+        epochs = mne.EpochsArray(data, info, events=mne_events,
                                  event_id=self.event_id, tmin=self.tmin)
         return epochs
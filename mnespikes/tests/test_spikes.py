@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from mnespikes import Neuron, spikes
+
+
+@pytest.fixture(params=['numba', 'numpy'])
+def bin_path(request, monkeypatch):
+    """Run a test with both the numba and the NumPy spike binning."""
+    if request.param == 'numba':
+        pytest.importorskip('numba')
+    else:
+        monkeypatch.setattr(spikes, '_has_numba', False)
+
+
+@pytest.mark.usefixtures('bin_path')
+def test_spikes():
+    """Test binning spike times into an array."""
+    neuron = Neuron([[.1, .25, .26], [], [.3]], sfreq=10, tmin=0, tmax=1)
+    assert neuron.spikes.shape == (3, 10)
+    assert neuron.spikes[0, 0] == 1
+    assert neuron.spikes[0, 1] == 2
+    assert neuron.spikes[1].sum() == 0
+    assert neuron.spikes[2, 2] == 1
+    # Spikes in the first sample period wrap around to the last bin
+    neuron = Neuron([[.05, .5]], sfreq=10, tmin=0, tmax=1)
+    assert neuron.spikes[0, 9] == 1
+    assert neuron.spikes[0, 4] == 1
+
+
+def test_spikes_long_recording():
+    """Test that more samples than int32 can index are supported."""
+    # A day at 30 kHz
+    neuron = Neuron([[10., 79999.5]], sfreq=3e4, tmin=0, tmax=8e4)
+    assert neuron.n_times == 2400000000
+
+
+def test_spikes_after_last_sample():
+    """Test that spikes past the last sample raise instead of overflowing."""
+    # int(tmin * sfreq) rounds toward zero, leaving 11 samples for a spike
+    # that falls in the 12th
+    with pytest.raises(ValueError, match='outside the 11 samples'):
+        Neuron([[0.5], [1.09]], sfreq=10, tmin=-0.15, tmax=1.09)
+    with pytest.raises(ValueError, match='outside the 11 samples'):
+        Neuron([[1.09], [0.5]], sfreq=10, tmin=-0.15, tmax=1.09)
+    # No samples at all between tmin and tmax
+    with pytest.raises(ValueError, match='outside the 0 samples'):
+        Neuron([[.5]], sfreq=10, tmin=.5, tmax=.5)
+
+
+@pytest.mark.usefixtures('bin_path')
+def test_from_many():
+    """Test creating several neurons at once."""
+    spiketimes = [[[.1, .25], [.5]], [[.3], [], [.7, .75]]]
+    neurons = Neuron.from_many(spiketimes, sfreq=10, tmin=0, tmax=1,
+                               names=['a', 'b'])
+    for neuron, ispiketimes in zip(neurons, spiketimes):
+        single = Neuron(ispiketimes, sfreq=10, tmin=0, tmax=1)
+        np.testing.assert_array_equal(neuron.spikes, single.spikes)
+    assert [neuron.name for neuron in neurons] == ['a', 'b']
+    # Any neuron with spikes past the last sample raises
+    with pytest.raises(ValueError, match='outside the 11 samples'):
+        Neuron.from_many([[[0.5], [1.09]], [[0.5], [0.5]]], sfreq=10,
+                         tmin=-0.15, tmax=1.09)
+
+
+@pytest.mark.usefixtures('bin_path')
+def test_spikes_dtype():
+    """Test that spike counts use uint16 without overflowing."""
+    neuron = Neuron([[.1, .15], [.5]], sfreq=10, tmin=0, tmax=1)
+    assert neuron.spikes.dtype == np.uint16
+    # More spikes in a bin than uint16 can hold
+    neuron = Neuron([np.full(70000, .5)], sfreq=1, tmin=0, tmax=1)
+    assert neuron.spikes[0, 0] == 70000
+    neurons = Neuron.from_many([[np.full(70000, .5)], [[.5]]], sfreq=1,
+                               tmin=0, tmax=1)
+    assert [neuron.spikes[0, 0] for neuron in neurons] == [70000, 1]
+
+
+def test_spiketimes():
+    """Test that spike times are kept at full precision."""
+    spiketimes = [[3600.0001, 3600.0004], [], [3600.5]]
+    neuron = Neuron(spiketimes, sfreq=1e4)
+    for trial, itrial in zip(neuron.spiketimes, spiketimes):
+        np.testing.assert_array_equal(trial, itrial)
+    assert neuron.max_spiketime == neuron.flat_times.max()
+
+
+def test_to_mne():
+    """Test converting spikes to an MNE Epochs object."""
+    pytest.importorskip('mne')
+    events = ['b', 'a', 'b']
+    neuron = Neuron([[.1, .25], [.5], [.3, .31]], sfreq=10, tmin=0, tmax=1,
+                    name='unit', events=events)
+    epochs = neuron.to_mne()
+    np.testing.assert_array_equal(epochs.events[:, 0], np.arange(3))
+    np.testing.assert_array_equal(epochs.events[:, 1], 0)
+    np.testing.assert_array_equal(epochs.events[:, 2],
+                                  [neuron.event_id[ev] for ev in events])
+    assert epochs.event_id == neuron.event_id
+    np.testing.assert_array_equal(epochs.get_data()[:, 0], neuron.spikes)
+    # Each call gets its own info
+    epochs_2 = neuron.to_mne()
+    assert epochs_2.info is not epochs.info
+    epochs_2.info['description'] = 'changed'
+    assert epochs.info['description'] is None
+    # The cached info follows changes to the name and sfreq
+    neuron.name = 'other'
+    neuron.sfreq = 20.
+    epochs_3 = neuron.to_mne()
+    assert epochs_3.ch_names == ['other']
+    assert epochs_3.info['sfreq'] == 20.